@@ -0,0 +1,55 @@
+import os
+import pickle
+from typing import Any, List
+import faiss
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+BINARY_INDEX_FILE = "index.binary.faiss"
+VECTORS_FILE = "vectors.fp16.npy"
+DOCUMENTS_FILE = "documents.pkl"
+
+def binarize(vectors):
+    """Pack the sign bit of every dimension into a Hamming code (dim / 8 bytes per vector)"""
+    return np.packbits(np.asarray(vectors) > 0, axis=-1)
+
+def build_binary_index(vectors):
+    index = faiss.IndexBinaryFlat(vectors.shape[1])
+    index.add(binarize(vectors))
+    return index
+
+def save_binary_store(save_dir, index, vectors, documents):
+    """Save the binary index, FP16 rerank vectors and documents side by side"""
+    os.makedirs(save_dir, exist_ok=True)
+    faiss.write_index_binary(index, os.path.join(save_dir, BINARY_INDEX_FILE))
+    np.save(os.path.join(save_dir, VECTORS_FILE), np.asarray(vectors, dtype=np.float16))
+    with open(os.path.join(save_dir, DOCUMENTS_FILE), "wb") as f:
+        pickle.dump(list(documents), f)
+
+def load_binary_store(save_dir):
+    index = faiss.read_index_binary(os.path.join(save_dir, BINARY_INDEX_FILE))
+    # Memory-mapped so a query only pages in the rows of its rerank candidates
+    vectors = np.load(os.path.join(save_dir, VECTORS_FILE), mmap_mode="r")
+    with open(os.path.join(save_dir, DOCUMENTS_FILE), "rb") as f:
+        documents = pickle.load(f)
+    return index, vectors, documents
+
+class BinaryRerankRetriever(BaseRetriever):
+    """Retrieve candidates by Hamming distance on binary codes, then rerank them by cosine on FP16 vectors"""
+
+    embeddings: Embeddings
+    index: Any
+    vectors: Any
+    documents: List[Document]
+    k: int = 3
+    num_candidates: int = 50
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        _, ids = self.index.search(binarize(query_vector[None, :]), min(self.num_candidates, self.index.ntotal))
+        candidates = ids[0][ids[0] >= 0]
+        scores = self.vectors[candidates].astype(np.float32) @ query_vector
+        return [self.documents[i] for i in candidates[np.argsort(-scores)[:self.k]]]
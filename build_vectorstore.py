@@ -1,53 +1,173 @@
-from pypdf import PdfReader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
-import os
-
-def read_pdf(file_path):
-    text = ""
-    reader = PdfReader(file_path)
-    for page in reader.pages:
-        page_text = page.extract_text()
-        if page_text:
-            text += page_text + "\n"
-    return text
-
-def split_text_to_documents(text, chunk_size=1000, chunk_overlap=200):
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap
-    )
-    texts = splitter.split_text(text)
-    documents = splitter.create_documents(texts)
-    return documents
-
-def create_faiss_vectorstore(pdf_path, save_dir):
-    print(f"Reading PDF from {pdf_path} ...")
-    doc_text = read_pdf(pdf_path)
-
-    print("Splitting document into chunks...")
-    documents = split_text_to_documents(doc_text)
-
-    print("Creating embeddings...")
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={"device": "cpu"}
-    )
-
-    print("Building FAISS vector store...")
-    vectorstore = FAISS.from_documents(documents, embeddings)
-
-    os.makedirs(save_dir, exist_ok=True)
-    vectorstore.save_local(save_dir)
-    print(f"Vector store saved at {save_dir}")
-
-if __name__ == "__main__":
-    import argparse
-
-    parser = argparse.ArgumentParser(description="Build FAISS vector store from PDF knowledge base")
-    parser.add_argument("--pdf", type=str, required=True, help="Path to PDF knowledge base file")
-    parser.add_argument("--output", type=str, required=True, help="Directory to save FAISS vector store")
-
-    args = parser.parse_args()
-    create_faiss_vectorstore(args.pdf, args.output)
+from config import EMBEDDING_PRECISION, FAISS_IVFPQ_MIN_VECTORS, FAISS_NLIST, FAISS_PQ_M, FAISS_PQ_NBITS
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+import math
+import multiprocessing
+import uuid
+import faiss
+import numpy as np
+import pypdfium2 as pdfium
+from pypdf import PdfReader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from binary_index import build_binary_index, save_binary_store
+from embeddings import ONNXMiniLMEmbeddings
+import os
+
+# Per-process handle to the PDF being extracted, opened once by each worker
+_worker_pdf = None
+
+def _init_pdf_worker(file_path):
+    global _worker_pdf
+    _worker_pdf = pdfium.PdfDocument(file_path)
+
+def _extract_page(index):
+    page = _worker_pdf[index]
+    textpage = page.get_textpage()
+    try:
+        return textpage.get_text_range().replace("\r\n", "\n")
+    finally:
+        textpage.close()
+        page.close()
+
+def _iter_pages_pypdf(file_path):
+    """Slower pure-Python extraction, used for PDFs pdfium cannot open (e.g. encrypted)"""
+    reader = PdfReader(file_path)
+    for page in reader.pages:
+        yield page.extract_text()
+
+def _iter_pages_pdfium(file_path, num_pages, max_workers):
+    max_workers = min(max_workers or os.cpu_count() or 1, num_pages)
+    # Pages are submitted a window at a time so finished-but-unconsumed pages stay bounded
+    window = 8 * max_workers
+    # Not forked from this process: the multi-threaded ONNX Runtime session already exists by now.
+    # A forkserver imports this module once in a single-threaded server and forks workers from it,
+    # instead of every spawned worker re-importing faiss, onnxruntime and transformers.
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context(start_method),
+        initializer=_init_pdf_worker,
+        initargs=(file_path,)
+    ) as executor:
+        for start in range(0, num_pages, window):
+            # map() yields results back in page order
+            yield from executor.map(_extract_page, range(start, min(start + window, num_pages)))
+
+def iter_pages(file_path, max_workers=None):
+    """Yield the non-empty text of each PDF page in order, extracting pages in parallel"""
+    try:
+        pdf = pdfium.PdfDocument(file_path)
+    except pdfium.PdfiumError:
+        pages = _iter_pages_pypdf(file_path)
+    else:
+        num_pages = len(pdf)
+        pdf.close()
+        pages = _iter_pages_pdfium(file_path, num_pages, max_workers) if num_pages else iter(())
+    return (page_text for page_text in pages if page_text)
+
+def read_pdf(file_path, max_workers=None):
+    return "\n".join(iter_pages(file_path, max_workers))
+
+@lru_cache(maxsize=None)
+def get_text_splitter(chunk_size=1000, chunk_overlap=200):
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+
+def iter_documents(file_path, chunk_size=1000, chunk_overlap=200):
+    """Yield chunk Documents while the PDF is being read, without materializing the whole text"""
+    splitter = get_text_splitter(chunk_size, chunk_overlap)
+    # Pending text is kept as a list of parts and joined once per split, not grown with +=
+    parts = []
+    buffered = 0
+    for page_text in iter_pages(file_path):
+        parts.append(page_text)
+        buffered += len(page_text) + 1
+        if buffered > 2 * chunk_size:
+            chunks = splitter.split_text("\n".join(parts))
+            # The last chunk may continue on the next page, so it is carried over and re-split
+            for chunk in chunks[:-1]:
+                yield Document(page_content=chunk)
+            # Whitespace-only text (e.g. blank or scanned pages) splits into no chunks at all
+            parts = chunks[-1:]
+            buffered = len(chunks[-1]) if chunks else 0
+    for chunk in splitter.split_text("\n".join(parts)):
+        yield Document(page_content=chunk)
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def build_faiss_index(vectors):
+    """Build an IVF-PQ index over the vectors, or a flat one when there are too few to train it.
+
+    With EMBEDDING_PRECISION = "fp16" the vectors are instead stored at half precision in a flat
+    scalar-quantized index.
+    """
+    num_vectors, dim = vectors.shape
+    if EMBEDDING_PRECISION == "fp16":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+        index.train(vectors)
+        index.add(vectors)
+        return index
+
+    nlist = min(4 * int(math.sqrt(num_vectors)), FAISS_NLIST)
+    if num_vectors < max(FAISS_IVFPQ_MIN_VECTORS, 39 * nlist):
+        index = faiss.IndexFlatL2(dim)
+    else:
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, FAISS_PQ_M, FAISS_PQ_NBITS)
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+def create_faiss_vectorstore(pdf_path, save_dir, embed_batch_size=256):
+    print("Creating embeddings...")
+    embeddings = ONNXMiniLMEmbeddings()
+    embeddings.embed_query("warmup")
+
+    print(f"Reading, splitting and embedding {pdf_path} ...")
+    documents = []
+    vector_batches = []
+    for batch in batched(iter_documents(pdf_path), embed_batch_size):
+        documents.extend(batch)
+        vector_batches.append(np.asarray(embeddings.embed_documents([doc.page_content for doc in batch]), dtype=np.float32))
+    if not vector_batches:
+        raise ValueError(f"No text could be extracted from {pdf_path}; scanned PDFs need OCR first")
+    vectors = np.concatenate(vector_batches)
+
+    if EMBEDDING_PRECISION == "binary":
+        print("Building binary FAISS index...")
+        save_binary_store(save_dir, build_binary_index(vectors), vectors, documents)
+        print(f"Vector store saved at {save_dir}")
+        return
+
+    print("Building FAISS vector store...")
+    index = build_faiss_index(vectors)
+    ids = [str(uuid.uuid4()) for _ in documents]
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(ids, documents))),
+        index_to_docstore_id=dict(enumerate(ids))
+    )
+
+    os.makedirs(save_dir, exist_ok=True)
+    vectorstore.save_local(save_dir)
+    print(f"Vector store saved at {save_dir}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build FAISS vector store from PDF knowledge base")
+    parser.add_argument("--pdf", type=str, required=True, help="Path to PDF knowledge base file")
+    parser.add_argument("--output", type=str, required=True, help="Directory to save FAISS vector store")
+
+    args = parser.parse_args()
+    create_faiss_vectorstore(args.pdf, args.output)
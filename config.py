@@ -3,6 +3,32 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Pin CPU threads for embedding and torch inference; 4-8 threads is the sweet spot for
+# MiniLM. The environment variables only take effect if this module is imported before
+# numpy/torch, so entry points import config first.
+NUM_THREADS = min(8, os.cpu_count() or 1)
+os.environ.setdefault("OMP_NUM_THREADS", str(NUM_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(NUM_THREADS))
+
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 VECTOR_STORE_PATH = "vector store/coffee_disease_knowledge"
 YOLO_WEIGHTS_PATH = "runs/detect/train8/weights/best.pt"
+YOLO_IMGSZ = 416
+YOLO_CONF = 0.25
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_ONNX_DIR = "models/all-MiniLM-L6-v2-onnx"
+RETRIEVAL_CACHE_DIR = ".retrieval_cache"
+
+# "float32" stores vectors in a FAISS IVF-PQ index; "fp16" stores them at half precision
+# in a flat scalar-quantized index; "binary" stores 1-bit codes searched by Hamming
+# distance and reranked on FP16 vectors
+EMBEDDING_PRECISION = "float32"
+
+# FAISS IVF-PQ index parameters. Knowledge bases with fewer vectors than
+# FAISS_IVFPQ_MIN_VECTORS keep an exact flat index: FAISS wants ~39 training points
+# per centroid, and each PQ codebook has 2 ** FAISS_PQ_NBITS centroids.
+FAISS_NLIST = 256
+FAISS_PQ_M = 16
+FAISS_PQ_NBITS = 8
+FAISS_NPROBE = 8
+FAISS_IVFPQ_MIN_VECTORS = 39 * 2 ** FAISS_PQ_NBITS
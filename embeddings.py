@@ -0,0 +1,166 @@
+import os
+from functools import lru_cache
+import numpy as np
+import onnxruntime as ort
+from transformers import AutoTokenizer
+from langchain_core.embeddings import Embeddings
+from config import EMBEDDING_MODEL_NAME, EMBEDDING_ONNX_DIR, NUM_THREADS
+
+ONNX_MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+
+def normalize_question(question):
+    """Canonical form of a question used as a cache key"""
+    return " ".join(question.split()).lower()
+
+def export_quantized_model(model_name, output_dir):
+    """Export a sentence-transformers model to ONNX and quantize its weights to INT8.
+
+    Mean pooling and L2 normalization are exported as part of the graph, and the encoder's
+    attention, LayerNorm and GELU subgraphs are fused into ONNX Runtime's transformer kernels
+    before quantization, so a single session call returns finished sentence embeddings.
+    """
+    import torch
+    from transformers import AutoModel
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from onnxruntime.transformers.optimizer import optimize_model
+
+    class PooledEncoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            token_embeddings = self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                token_type_ids=token_type_ids
+            ).last_hidden_state
+            mask = attention_mask.unsqueeze(-1).to(token_embeddings.dtype)
+            pooled = (token_embeddings * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            return torch.nn.functional.normalize(pooled, dim=1)
+
+    print(f"Exporting {model_name} to ONNX in {output_dir} ...")
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer.save_pretrained(output_dir)
+    model = AutoModel.from_pretrained(model_name).eval()
+
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    sample = tokenizer(["warmup"], return_tensors="pt")
+    onnx_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            PooledEncoder(model),
+            tuple(sample[name] for name in input_names),
+            onnx_path,
+            input_names=input_names,
+            output_names=["sentence_embedding"],
+            dynamic_axes={
+                **{name: {0: "batch", 1: "sequence"} for name in input_names},
+                "sentence_embedding": {0: "batch"}
+            },
+            opset_version=14,
+            # The dynamo exporter ignores dynamic_axes and needs onnxscript
+            dynamo=False
+        )
+
+    optimized = optimize_model(
+        onnx_path,
+        model_type="bert",
+        num_heads=model.config.num_attention_heads,
+        hidden_size=model.config.hidden_size
+    )
+    optimized.save_model_to_file(onnx_path)
+
+    quantize_dynamic(
+        model_input=onnx_path,
+        model_output=os.path.join(output_dir, QUANTIZED_MODEL_FILE),
+        weight_type=QuantType.QInt8
+    )
+
+class ONNXMiniLMEmbeddings(Embeddings):
+    """MiniLM sentence embeddings computed with an INT8 ONNX Runtime session on CPU"""
+
+    def __init__(self, model_dir=EMBEDDING_ONNX_DIR, model_name=EMBEDDING_MODEL_NAME, token_budget=8192, max_length=256, query_cache_size=4096, num_threads=NUM_THREADS):
+        model_path = os.path.join(model_dir, QUANTIZED_MODEL_FILE)
+        if not os.path.exists(model_path):
+            export_quantized_model(model_name, model_dir)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.token_budget = token_budget
+        self.max_length = max_length
+        # Repeated questions (e.g. the formulaic remedy prompt) skip the forward pass
+        self._embed_query = lru_cache(maxsize=query_cache_size)(self._embed_query_uncached)
+        # An uncased WordPiece tokenizer lowercases and splits on whitespace itself, so queries
+        # can share cache entries by their normalized text without changing the embedding
+        self._normalize_queries = getattr(self.tokenizer, "do_lower_case", False)
+
+    def _tokenize(self, texts):
+        return self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+
+    def _embed(self, sequences):
+        """Embed a batch of token id sequences, padded only to the longest one in the batch"""
+        input_ids = np.full((len(sequences), max(map(len, sequences))), self.tokenizer.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros_like(input_ids)
+        for row, ids in enumerate(sequences):
+            input_ids[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+
+        inputs = {
+            "input_ids": input_ids,
+            "attention_mask": attention_mask,
+            "token_type_ids": np.zeros_like(input_ids)
+        }
+        inputs = {name: array for name, array in inputs.items() if name in self.input_names}
+        outputs = self.session.run(None, inputs)[0]
+        if outputs.ndim == 2:
+            # Pooling and normalization already ran inside the graph
+            return outputs
+
+        # Models exported without pooling return token embeddings: mean pool over real tokens
+        # followed by L2 normalization, as in sentence-transformers
+        token_embeddings = outputs
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def _length_batches(self, lengths):
+        """Group sequence indices sorted by length so that each padded batch fits the token budget"""
+        batch = []
+        for index in np.argsort(lengths, kind="stable"):
+            # Lengths are ascending, so the padded size of a batch is its size times the newest length
+            if batch and (len(batch) + 1) * lengths[index] > self.token_budget:
+                yield batch
+                batch = []
+            batch.append(index)
+        if batch:
+            yield batch
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        sequences = self._tokenize(list(texts))
+        vectors = None
+        for batch in self._length_batches([len(ids) for ids in sequences]):
+            batch_vectors = self._embed([sequences[i] for i in batch])
+            if vectors is None:
+                vectors = np.empty((len(sequences), batch_vectors.shape[1]), dtype=np.float32)
+            # Scatter back into the caller's order
+            vectors[batch] = batch_vectors
+        return vectors.tolist()
+
+    def _embed_query_uncached(self, text):
+        return tuple(self._embed(self._tokenize([text]))[0].tolist())
+
+    def embed_query(self, text):
+        if self._normalize_queries:
+            text = normalize_question(text)
+        return list(self._embed_query(text))
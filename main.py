@@ -1,19 +1,54 @@
+from config import GROQ_API_KEY, VECTOR_STORE_PATH, YOLO_WEIGHTS_PATH
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from PIL import Image
-from config import GROQ_API_KEY, VECTOR_STORE_PATH, YOLO_WEIGHTS_PATH
 from yolo_model import load_yolo_model, detect_diseases
-from rag_chat import prepare_rag_llm, generate_answer
+from rag_chat import prepare_rag_llm, stream_answer
+
+@lru_cache(maxsize=None)
+def remedy_question(diseases):
+    return f"What is the remedy for {', '.join(diseases)} in coffee leaves? Provide detailed treatment and prevention methods."
+
+class RemedyUnavailable(Exception):
+    """Raised from get_remedy so that error replies are shown but never cached"""
+
+    def __init__(self, answer, sources):
+        super().__init__(answer)
+        self.answer = answer
+        self.sources = sources
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_remedy(diseases, _conversation, _llm, _computed=None):
+    """Remedy answer for a sorted tuple of diseases, shared by every upload with the same detections.
+
+    ``_computed`` is appended to when the answer is generated rather than served from the cache.
+    """
+    if _computed is not None:
+        _computed.append(diseases)
+    remedy_stream = stream_answer(remedy_question(diseases), _conversation, _llm)
+    for _ in remedy_stream:
+        pass
+    if remedy_stream.failed:
+        raise RemedyUnavailable(remedy_stream.answer, remedy_stream.sources)
+    return remedy_stream.answer, remedy_stream.sources
 
 def main():
     st.title("Coffee Leaf Disease Detector & RAG Assistant ☕🌿")
 
-    # Load YOLO model
-    yolo_model = load_yolo_model(YOLO_WEIGHTS_PATH)
+    # Load YOLO model, together with the RAG system on the first run. Both loaders are
+    # cached and spend most of their time in I/O and native code, so they overlap well.
+    needs_rag = "conversation" not in st.session_state and GROQ_API_KEY
+    with ThreadPoolExecutor(max_workers=2, initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())) as executor:
+        yolo_future = executor.submit(load_yolo_model, YOLO_WEIGHTS_PATH)
+        rag_future = executor.submit(prepare_rag_llm, GROQ_API_KEY, VECTOR_STORE_PATH) if needs_rag else None
+        yolo_model = yolo_future.result()
 
     # Initialize RAG system in session state once
     if "conversation" not in st.session_state:
         if GROQ_API_KEY:
-            qa_chain, llm, memory = prepare_rag_llm(GROQ_API_KEY, VECTOR_STORE_PATH)
+            qa_chain, llm, memory = rag_future.result()
             st.session_state.conversation = qa_chain
             st.session_state.llm = llm
             st.session_state.memory = memory
@@ -36,14 +71,27 @@ def main():
             detected_classes, annotated_img = detect_diseases(img, yolo_model)
 
         if detected_classes:
-            st.image(annotated_img, caption="Detection Results", use_container_width=True)
-            unique_diseases = set(detected_classes)
+            if annotated_img is not None:
+                st.image(annotated_img, caption="Detection Results", use_container_width=True)
+            # Sorted so the same set of diseases always yields the same question and cache key
+            unique_diseases = tuple(sorted(set(detected_classes)))
             st.success(f"🦠 **Detected disease(s):** {', '.join(unique_diseases)}")
 
             # Generate remedy automatically
             with st.spinner("Generating remedy suggestions..."):
-                remedy_question = f"What is the remedy for {', '.join(unique_diseases)} in coffee leaves? Provide detailed treatment and prevention methods."
-                remedy, sources = generate_answer(remedy_question, st.session_state.conversation, st.session_state.llm)
+                computed = []
+                try:
+                    remedy, sources = get_remedy(unique_diseases, st.session_state.conversation, st.session_state.llm, _computed=computed)
+                except RemedyUnavailable as e:
+                    remedy, sources = e.answer, e.sources
+
+            # A cached remedy skips the chain, so record the turn in memory ourselves, once per upload,
+            # so that follow-up questions can refer back to it
+            remedy_turn = (uploaded_file.file_id, unique_diseases)
+            if st.session_state.get("remedy_turn") != remedy_turn:
+                if not computed:
+                    st.session_state.conversation.save_turn(remedy_question(unique_diseases), remedy)
+                st.session_state.remedy_turn = remedy_turn
             
             st.markdown("### 💊 Suggested Remedy")
             st.markdown(remedy)
@@ -66,43 +114,42 @@ def main():
         st.markdown("## 💬 Ask Follow-up Questions")
         st.markdown("Ask me anything about coffee leaf diseases, treatments, prevention, or general coffee cultivation!")
 
-        # Display chat history
+        # Display chat history; chat messages are rendered by Streamlit's own chat elements
         chat_container = st.container()
         with chat_container:
-            for i, (speaker, message) in enumerate(st.session_state.chat_history):
-                if speaker == "You":
-                    st.markdown(f"**🙋 You:** {message}")
-                else:
-                    st.markdown(f"**🤖 Assistant:** {message}")
-                    if i < len(st.session_state.chat_history) - 1:  # Add separator except for last message
-                        st.markdown("---")
+            for speaker, message in st.session_state.chat_history:
+                role, avatar = ("user", "🙋") if speaker == "You" else ("assistant", "🤖")
+                with st.chat_message(role, avatar=avatar):
+                    st.markdown(message)
 
         # Chat input section
-        with st.form(key="chat_form", clear_on_submit=True):
-            user_question = st.text_input(
-                "Your question:", 
-                placeholder="e.g., How can I prevent coffee leaf rust? What are the symptoms of coffee berry disease?",
-                key="chat_input"
-            )
-            submit_button = st.form_submit_button("Send 📤")
+        user_question = st.chat_input(
+            "e.g., How can I prevent coffee leaf rust? What are the symptoms of coffee berry disease?",
+            key="chat_input"
+        )
 
         # Process user input
-        if submit_button and user_question.strip():
+        if user_question and user_question.strip():
             # Add user question to chat history
             st.session_state.chat_history.append(("You", user_question))
-            
-            # Generate answer
-            with st.spinner("Thinking..."):
-                answer, sources = generate_answer(user_question, st.session_state.conversation, st.session_state.llm)
+
+            with chat_container:
+                with st.chat_message("user", avatar="🙋"):
+                    st.markdown(user_question)
+
+                # Stream the answer, then replace it with the final (cleaned up or fallback) text
+                with st.chat_message("assistant", avatar="🤖"):
+                    answer_stream = stream_answer(user_question, st.session_state.conversation, st.session_state.llm)
+                    answer_placeholder = st.empty()
+                    with answer_placeholder.container():
+                        st.write_stream(answer_stream)
+                    answer_placeholder.markdown(answer_stream.answer)
             
             # Add assistant response to chat history
-            st.session_state.chat_history.append(("Assistant", answer))
+            st.session_state.chat_history.append(("Assistant", answer_stream.answer))
             
             # Store sources for the latest response
-            st.session_state.latest_sources = sources
-            
-            # Rerun to update the display
-            st.rerun()
+            st.session_state.latest_sources = answer_stream.sources
 
         # Show sources for the latest response (if available)
         if hasattr(st.session_state, 'latest_sources') and st.session_state.latest_sources:
@@ -1,10 +1,138 @@
-from langchain.embeddings import HuggingFaceEmbeddings
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import re
+from typing import Any, List
+import diskcache
+import faiss
+import numpy as np
 from langchain_community.vectorstores import FAISS
-from langchain.chains import ConversationalRetrievalChain
+from binary_index import BinaryRerankRetriever, load_binary_store
+from embeddings import ONNXMiniLMEmbeddings, normalize_question
 from langchain.memory import ConversationBufferWindowMemory
 from langchain.prompts import PromptTemplate
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 from langchain_groq import ChatGroq
 import streamlit as st
+from config import EMBEDDING_PRECISION, FAISS_NPROBE, RETRIEVAL_CACHE_DIR
+
+COFFEE_KEYWORDS = ['coffee', 'leaf', 'disease', 'plant', 'crop', 'fungus', 'pest', 'treatment', 'remedy', 'cultivation', 'agriculture', 'farming']
+GENERAL_GREETINGS = ['hi', 'hello', 'good morning', 'good afternoon', 'good evening', 'how are you', 'thanks', 'thank you']
+
+# Compiled once so each question is classified in a single scan. Coffee keywords only
+# anchor at the start of a word so plurals ("diseases") still match; greetings must be
+# whole words so e.g. "which" or "this" is not mistaken for "hi".
+COFFEE_RE = re.compile(r"\b(?:" + "|".join(map(re.escape, COFFEE_KEYWORDS)) + r")", re.IGNORECASE)
+GREETING_RE = re.compile(r"\b(?:" + "|".join(map(re.escape, GENERAL_GREETINGS)) + r")\b", re.IGNORECASE)
+
+# Words that refer back to an earlier turn, so the question needs that turn to make sense
+FOLLOW_UP_RE = re.compile(r"\b(?:it|its|this|these|those|they|them|their|the same)\b", re.IGNORECASE)
+
+# Minimum cosine similarity between question and RAG answer before falling back to the LLM
+RELEVANCE_THRESHOLD = 0.35
+
+class CachedRetriever(BaseRetriever):
+    """Persist retrieved documents on disk, keyed by the normalized query"""
+
+    retriever: BaseRetriever
+    cache: Any
+    namespace: str = ""
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        key = hashlib.sha1(f"{self.namespace}\n{normalize_question(query)}".encode("utf-8")).hexdigest()
+        documents = self.cache.get(key)
+        if documents is None:
+            documents = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+            self.cache.set(key, documents)
+        return documents
+
+def vector_store_version(vector_store_path):
+    """Identify the vector store on disk so cached retrievals are dropped when it is rebuilt"""
+    mtimes = [entry.stat().st_mtime for entry in os.scandir(vector_store_path) if entry.is_file()]
+    return f"{os.path.abspath(vector_store_path)}:{EMBEDDING_PRECISION}:{max(mtimes, default=0)}"
+
+@st.cache_resource(show_spinner=False)
+def load_embeddings():
+    """Shared embedding model for retrieval and answer relevance checks"""
+    embeddings = ONNXMiniLMEmbeddings()
+    # Prime the session's allocator and kernels before the first real query
+    embeddings.embed_query("warmup")
+    return embeddings
+
+def _stream_llm(llm, prompt):
+    """Yield the LLM response chunk by chunk and return the full text"""
+    parts = []
+    for chunk in llm.stream(prompt):
+        parts.append(chunk.content)
+        yield chunk.content
+    return "".join(parts)
+
+class StreamingRAGChain:
+    """Rewrite -> retrieve -> generate pipeline whose answer is streamed from the LLM"""
+
+    def __init__(self, llm, retriever, memory, prompt):
+        self.llm = llm
+        self.retriever = retriever
+        self.memory = memory
+        self.prompt = prompt
+        self.executor = ThreadPoolExecutor(max_workers=2)
+
+    def previous_question(self):
+        """The last user question held in memory, or None"""
+        chat_history = self.memory.load_memory_variables({})["chat_history"]
+        previous_questions = [message.content for message in chat_history if message.type == "human"]
+        return previous_questions[-1] if previous_questions else None
+
+    def is_follow_up(self, question):
+        """Whether the question refers back to an earlier user question in memory"""
+        return bool(FOLLOW_UP_RE.search(question)) and self.previous_question() is not None
+
+    def standalone_question(self, question):
+        """Rewrite a follow-up question for retrieval without an extra LLM round trip.
+
+        Questions are kept as-is unless they refer back to the conversation, in which
+        case the previous user question is prepended to supply the missing subject.
+        """
+        if not self.is_follow_up(question):
+            return question
+        return f"{self.previous_question()} {question}"
+
+    def stream(self, question):
+        """Retrieve context for the question and start generating the answer.
+
+        Returns the retrieved documents and a generator of answer chunks whose
+        return value is the full answer text.
+        """
+        # The rewritten question only steers retrieval; the LLM answers what the user asked
+        retrieval = self.executor.submit(self.retriever.invoke, self.standalone_question(question))
+        # Bind the question while retrieval is running; only the context is left to fill in
+        prompt = self.prompt.partial(question=question)
+        source_docs = retrieval.result()
+        context = "\n\n".join(doc.page_content for doc in source_docs)
+        return source_docs, _stream_llm(self.llm, prompt.format(context=context))
+
+    def save_turn(self, question, answer):
+        self.memory.save_context({"question": question}, {"answer": answer})
+
+class AnswerStream:
+    """Iterable of answer text chunks, e.g. for st.write_stream.
+
+    Once iteration finishes, ``answer`` and ``sources`` hold the final result. The
+    answer can differ from the streamed text when it was cleaned up or replaced by
+    the LLM fallback, so callers should re-render it. ``failed`` is set when the answer
+    is an error reply or a stand-in for an unavailable RAG system.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.answer = ""
+        self.sources = []
+        self.failed = False
+
+    def __iter__(self):
+        self.answer, self.sources, self.failed = yield from self._chunks
 
 def create_custom_prompt():
     """Create a custom prompt template for better RAG responses"""
@@ -28,7 +156,8 @@ def prepare_rag_llm(api_key, vector_store_path, temperature=0.3, max_length=2048
             api_key=api_key,
             model="llama3-8b-8192",
             temperature=temperature,
-            max_tokens=max_length
+            max_tokens=max_length,
+            streaming=True
         )
 
         memory = ConversationBufferWindowMemory(
@@ -38,31 +167,42 @@ def prepare_rag_llm(api_key, vector_store_path, temperature=0.3, max_length=2048
             return_messages=True,
         )
 
-        embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'}
-        )
+        embeddings = load_embeddings()
 
-        # Load vector store
-        db = FAISS.load_local(
-            vector_store_path,
-            embeddings,
-            allow_dangerous_deserialization=True
-        )
+        if EMBEDDING_PRECISION == "binary":
+            index, vectors, documents = load_binary_store(vector_store_path)
+            retriever = BinaryRerankRetriever(
+                embeddings=embeddings,
+                index=index,
+                vectors=vectors,
+                documents=documents,
+                k=3
+            )
+        else:
+            # Load vector store
+            db = FAISS.load_local(
+                vector_store_path,
+                embeddings,
+                allow_dangerous_deserialization=True
+            )
+            ivf_index = faiss.try_extract_index_ivf(db.index)
+            if ivf_index is not None:
+                ivf_index.nprobe = FAISS_NPROBE
+
+            # Create conversational retrieval chain with custom retriever
+            retriever = db.as_retriever(search_kwargs={"k": 3, "fetch_k": 10})
 
-        # Create conversational retrieval chain with custom retriever
-        retriever = db.as_retriever(search_kwargs={"k": 3, "fetch_k": 10})
+        retriever = CachedRetriever(
+            retriever=retriever,
+            cache=diskcache.Cache(RETRIEVAL_CACHE_DIR),
+            namespace=vector_store_version(vector_store_path)
+        )
         
-        qa_chain = ConversationalRetrievalChain.from_llm(
+        qa_chain = StreamingRAGChain(
             llm=llm,
-            chain_type="stuff",
             retriever=retriever,
-            return_source_documents=True,
             memory=memory,
-            verbose=False,
-            combine_docs_chain_kwargs={
-                "prompt": create_custom_prompt()
-            }
+            prompt=create_custom_prompt()
         )
 
         return qa_chain, llm, memory
@@ -71,18 +211,48 @@ def prepare_rag_llm(api_key, vector_store_path, temperature=0.3, max_length=2048
         st.error(f"Error initializing RAG system: {str(e)}")
         return None, None, None
 
+def looks_irrelevant(question, answer):
+    """Check if the answer seems to be a generic/irrelevant response from the RAG system"""
+    answer_lc = answer.lower()
+    question_lc = question.lower()
+    if (
+        "according to the provided coffee leaf disease guide" in answer_lc
+        or ("leaf miner" in answer_lc and "leaf miner" not in question_lc)
+        or len(answer.strip()) < 20
+        or (answer.lstrip().startswith("*") and question_lc not in answer_lc)
+    ):
+        return True
+
+    # Check similarity between question and answer; embeddings are L2-normalized,
+    # so the dot product is their cosine similarity
+    embeddings = load_embeddings()
+    similarity_score = float(np.dot(embeddings.embed_query(question), embeddings.embed_query(answer)))
+    return similarity_score < RELEVANCE_THRESHOLD
+
+def stream_answer(question, conversation, llm=None):
+    """Stream the answer to a question; see AnswerStream"""
+    return AnswerStream(_answer_chunks(question, conversation, llm))
+
 def generate_answer(question, conversation, llm=None):
     """Generate answer using RAG or fallback to LLM"""
+    stream = stream_answer(question, conversation, llm)
+    for _ in stream:
+        pass
+    return stream.answer, stream.sources
+
+def _answer_chunks(question, conversation, llm):
     if not conversation:
-        return "RAG system not initialized.", []
+        answer = "RAG system not initialized."
+        yield answer
+        return answer, [], True
 
     # First, check if question is related to coffee/agriculture
-    coffee_keywords = ['coffee', 'leaf', 'disease', 'plant', 'crop', 'fungus', 'pest', 'treatment', 'remedy', 'cultivation', 'agriculture', 'farming']
-    is_coffee_related = any(keyword.lower() in question.lower() for keyword in coffee_keywords)
+    # Follow-ups such as "how often should I apply it?" name no keyword themselves but
+    # continue the coffee conversation held in memory
+    is_coffee_related = bool(COFFEE_RE.search(question)) or conversation.is_follow_up(question)
     
     # For general greetings or non-coffee questions, use LLM directly
-    general_greetings = ['hi', 'hello', 'good morning', 'good afternoon', 'good evening', 'how are you', 'thanks', 'thank you']
-    is_greeting = any(greeting.lower() in question.lower() for greeting in general_greetings)
+    is_greeting = bool(GREETING_RE.search(question))
     
     if is_greeting or not is_coffee_related:
         if llm:
@@ -102,66 +272,49 @@ def generate_answer(question, conversation, llm=None):
                     If this question is not related to coffee, plants, or agriculture, politely redirect them to coffee-related topics while still being helpful.
                     """
                 
-                answer = llm.predict(greeting_prompt)
-                return answer.strip(), ["Generated from general knowledge"]
+                answer = yield from _stream_llm(llm, greeting_prompt)
+                return answer.strip(), ["Generated from general knowledge"], False
             except Exception as e:
-                return "Hello! I'm here to help you with coffee leaf diseases and cultivation questions. How can I assist you today?", []
+                answer = "Hello! I'm here to help you with coffee leaf diseases and cultivation questions. How can I assist you today?"
+                yield answer
+                return answer, [], True
 
     try:
-        # Get response from conversational retrieval chain for coffee-related questions
-        response = conversation({"question": question})
+        # Get response from the retrieval chain for coffee-related questions
+        source_docs, chunks = conversation.stream(question)
+        sources = [doc.page_content for doc in source_docs]
+        answer = yield from chunks
         
-        if isinstance(response, dict) and "answer" in response:
-            answer = response["answer"]
-            source_docs = response.get("source_documents", [])
-            sources = [doc.page_content for doc in source_docs]
-            
-            # Clean up the answer
-            if "Helpful Answer:" in answer:
-                answer = answer.split("Helpful Answer:")[-1].strip()
-            
-            # Check if the answer seems to be a generic/irrelevant response
-            # Look for signs that the RAG system returned irrelevant content
-            irrelevant_indicators = [
-                "according to the provided coffee leaf disease guide" in answer.lower(),
-                "leaf miner" in answer.lower() and "leaf miner" not in question.lower(),
-                len(answer.strip()) < 20,
-                answer.strip().startswith("*") and question.lower() not in answer.lower()
-            ]
-            
-            # Check similarity between question and answer
-            question_words = set(question.lower().split())
-            answer_words = set(answer.lower().split())
-            common_words = question_words.intersection(answer_words)
-            similarity_score = len(common_words) / max(len(question_words), 1)
-            
-            # If answer seems irrelevant or has low similarity, use LLM fallback
-            if any(irrelevant_indicators) or similarity_score < 0.1:
-                if llm:
-                    try:
-                        fallback_prompt = f"""
-                        You are an expert in coffee cultivation and plant pathology. Please provide a detailed and helpful answer to the following question:
-                        
-                        Question: {question}
-                        
-                        If you don't have specific information about this topic, please say so and provide general guidance where appropriate.
-                        Be honest about the limitations of your knowledge while still being helpful.
-                        """
-                        
-                        llm_response = llm.predict(fallback_prompt)
-                        answer = llm_response.strip()
-                        sources = ["Generated from general agricultural knowledge"]
-                    except Exception as e:
-                        print(f"Fallback LLM failed: {e}")
-                        # Keep original answer if fallback fails
-            
-            # Clean up sources
-            if not sources or all(len(src.strip()) < 20 for src in sources):
-                sources = ["Retrieved from knowledge base"]
-                
-        else:
-            answer = str(response)
-            sources = ["No sources available"]
+        # Clean up the answer
+        if "Helpful Answer:" in answer:
+            answer = answer.split("Helpful Answer:")[-1].strip()
+        
+        # If answer seems irrelevant or has low similarity, use LLM fallback
+        if looks_irrelevant(question, answer):
+            if llm:
+                try:
+                    fallback_prompt = f"""
+                    You are an expert in coffee cultivation and plant pathology. Please provide a detailed and helpful answer to the following question:
+                    
+                    Question: {question}
+                    
+                    If you don't have specific information about this topic, please say so and provide general guidance where appropriate.
+                    Be honest about the limitations of your knowledge while still being helpful.
+                    """
+                    
+                    llm_response = llm.predict(fallback_prompt)
+                    answer = llm_response.strip()
+                    sources = ["Generated from general agricultural knowledge"]
+                except Exception as e:
+                    print(f"Fallback LLM failed: {e}")
+                    # Keep original answer if fallback fails
+        
+        # Clean up sources
+        if not sources or all(len(src.strip()) < 20 for src in sources):
+            sources = ["Retrieved from knowledge base"]
+
+        conversation.save_turn(question, answer)
+        failed = False
             
     except Exception as e:
         error_msg = f"Error generating answer: {str(e)}"
@@ -184,8 +337,10 @@ def generate_answer(question, conversation, llm=None):
         else:
             answer = "I'm sorry, I'm unable to process your question right now. Please try again later."
             sources = []
+        failed = True
+        yield answer
 
-    return answer, sources
+    return answer, sources, failed
 
 def reset_conversation_memory(memory):
     """Reset the conversation memory"""
@@ -1,16 +1,72 @@
+import importlib.util
+import os
+import numpy as np
+import torch
 from ultralytics import YOLO
 from PIL import Image
 import streamlit as st
+from config import YOLO_CONF, YOLO_IMGSZ
+
+def _export(weights_path, export_format, **export_kwargs):
+    """Export the checkpoint to one format, reusing an earlier export or giving up on an earlier failure.
+
+    Returns the exported model path, or None if the export is unavailable.
+    """
+    exported_path = os.path.splitext(weights_path)[0] + (".engine" if export_format == "engine" else ".onnx")
+    failed_marker = exported_path + ".failed"
+    if os.path.exists(exported_path):
+        return exported_path
+    if os.path.exists(failed_marker):
+        return None
+    try:
+        return YOLO(weights_path).export(format=export_format, imgsz=YOLO_IMGSZ, **export_kwargs)
+    except Exception as e:
+        print(f"YOLO {export_format} export failed: {e}")
+        # Remember the failure so cold starts don't retry it; delete the marker to try again
+        with open(failed_marker, "w") as f:
+            f.write(str(e))
+        return None
+
+def export_yolo_model(weights_path):
+    """Export the PyTorch checkpoint once, to a TensorRT FP16 engine on GPU or ONNX otherwise.
+
+    Returns the path of the exported model, or the original weights if no export is available.
+    """
+    # Only attempt TensorRT when it is installed, so Ultralytics never tries to pip-install it here.
+    # simplify stays off for the same reason: it pulls in onnxslim and, on CUDA hosts,
+    # onnxruntime-gpu alongside the CPU onnxruntime the embeddings rely on.
+    if torch.cuda.is_available() and importlib.util.find_spec("tensorrt") is not None:
+        engine_path = _export(weights_path, "engine", half=True, dynamic=True, simplify=False)
+        if engine_path:
+            return engine_path
+    return _export(weights_path, "onnx", dynamic=True, simplify=False) or weights_path
 
 @st.cache_resource
 def load_yolo_model(weights_path):
-    model = YOLO(weights_path)
+    model_path = export_yolo_model(weights_path)
+    model = YOLO(model_path, task="detect")
+    # FP16 inputs need an FP16 model: the TensorRT engine or the PyTorch weights, not the FP32 ONNX export
+    model.use_half = torch.cuda.is_available() and not str(model_path).endswith(".onnx")
+    # Warm up on a blank image: this builds the predictor and backend once, here rather than on the
+    # first upload, and gives exported models their class names without a second backend load
+    model(Image.new("RGB", (YOLO_IMGSZ, YOLO_IMGSZ)), **_predict_kwargs(model))
+    names = model.predictor.model.names
+    # Class names as an array so detections map to names with one vectorized lookup
+    model.class_names = np.asarray([names[i] for i in range(len(names))])
     return model
 
+def _predict_kwargs(model):
+    predict_kwargs = {"imgsz": YOLO_IMGSZ, "conf": YOLO_CONF, "verbose": False}
+    if torch.cuda.is_available():
+        predict_kwargs.update(half=model.use_half, device=0)
+    return predict_kwargs
+
 def detect_diseases(image: Image.Image, model):
-    results = model(image)
-    names = results[0].names
+    results = model(image, **_predict_kwargs(model))
     boxes = results[0].boxes
-    detected_classes = [names[int(cls)] for cls in boxes.cls.cpu()]
-    annotated_img = results[0].plot()
+    # A single device-to-host copy of all class ids
+    cls_ids = boxes.cls.to(torch.int64).tolist()
+    detected_classes = model.class_names[cls_ids].tolist()
+    # Only rasterize the annotations when there is something to show
+    annotated_img = results[0].plot() if detected_classes else None
     return detected_classes, annotated_img